@@ -3,97 +3,135 @@ from sklearn.model_selection import train_test_split
 from sklearn.linear_model import SGDClassifier
 from sklearn.metrics import accuracy_score, classification_report
 from sklearn.preprocessing import LabelEncoder, StandardScaler
-from joblib import dump, load
+from joblib import dump, load, Parallel, delayed
 import os
 import numpy as np
 
+try:
+    import polars as pl
+except ImportError:
+    pl = None  # optional; pandas chunked reading is used without it
+
 # Path to the model file
 model_file = "incremental_model.joblib"
 scaler_file = "scaler.joblib"
-# Load the CSV file
-def load_dataset(csv_file):
-    """
-    Load a CSV dataset and select relevant columns for training.
-    Missing values are filled with 0. Rows with NaN are dropped.
-    """
-    df = pd.read_csv(csv_file, header=None, low_memory=False)
-
-    column_names = [
-        "Destination Port", "Flow Duration", "Total Fwd Packets", "Total Backward Packets",
-        "Total Length of Fwd Packets", "Total Length of Bwd Packets", "Fwd Packet Length Max",
-        "Fwd Packet Length Min", "Fwd Packet Length Mean", "Fwd Packet Length Std",
-        "Bwd Packet Length Max", "Bwd Packet Length Min", "Bwd Packet Length Mean", "Bwd Packet Length Std",
-        "Flow Bytes/s", "Flow Packets/s", "Flow IAT Mean", "Flow IAT Std", "Flow IAT Max", "Flow IAT Min",
-        "Fwd IAT Total", "Fwd IAT Mean", "Fwd IAT Std", "Fwd IAT Max", "Fwd IAT Min",
-        "Bwd IAT Total", "Bwd IAT Mean", "Bwd IAT Std", "Bwd IAT Max", "Bwd IAT Min",
-        "Fwd PSH Flags", "Bwd PSH Flags", "Fwd URG Flags", "Bwd URG Flags", "Fwd Header Length",
-        "Bwd Header Length", "Fwd Packets/s", "Bwd Packets/s", "Min Packet Length", "Max Packet Length",
-        "Packet Length Mean", "Packet Length Std", "Packet Length Variance", "FIN Flag Count",
-        "SYN Flag Count", "RST Flag Count", "PSH Flag Count", "ACK Flag Count", "URG Flag Count",
-        "CWE Flag Count", "ECE Flag Count", "Down/Up Ratio", "Average Packet Size", "Avg Fwd Segment Size",
-        "Avg Bwd Segment Size", "Fwd Header Length", "Fwd Avg Bytes/Bulk", "Fwd Avg Packets/Bulk",
-        "Fwd Avg Bulk Rate", "Bwd Avg Bytes/Bulk", "Bwd Avg Packets/Bulk", "Bwd Avg Bulk Rate",
-        "Subflow Fwd Packets", "Subflow Fwd Bytes", "Subflow Bwd Packets", "Subflow Bwd Bytes",
-        "Init_Win_bytes_forward", "Init_Win_bytes_backward", "act_data_pkt_fwd", "min_seg_size_forward",
-        "Active Mean", "Active Std", "Active Max", "Active Min", "Idle Mean", "Idle Std", "Idle Max",
-        "Idle Min", "Label"
-    ]
-
-    df.columns = column_names
 
+# Rows per chunk when streaming the CSV files
+chunk_size = 200_000
+
+# Column layout of the raw CICIDS CSV files
+column_names = [
+    "Destination Port", "Flow Duration", "Total Fwd Packets", "Total Backward Packets",
+    "Total Length of Fwd Packets", "Total Length of Bwd Packets", "Fwd Packet Length Max",
+    "Fwd Packet Length Min", "Fwd Packet Length Mean", "Fwd Packet Length Std",
+    "Bwd Packet Length Max", "Bwd Packet Length Min", "Bwd Packet Length Mean", "Bwd Packet Length Std",
+    "Flow Bytes/s", "Flow Packets/s", "Flow IAT Mean", "Flow IAT Std", "Flow IAT Max", "Flow IAT Min",
+    "Fwd IAT Total", "Fwd IAT Mean", "Fwd IAT Std", "Fwd IAT Max", "Fwd IAT Min",
+    "Bwd IAT Total", "Bwd IAT Mean", "Bwd IAT Std", "Bwd IAT Max", "Bwd IAT Min",
+    "Fwd PSH Flags", "Bwd PSH Flags", "Fwd URG Flags", "Bwd URG Flags", "Fwd Header Length",
+    "Bwd Header Length", "Fwd Packets/s", "Bwd Packets/s", "Min Packet Length", "Max Packet Length",
+    "Packet Length Mean", "Packet Length Std", "Packet Length Variance", "FIN Flag Count",
+    "SYN Flag Count", "RST Flag Count", "PSH Flag Count", "ACK Flag Count", "URG Flag Count",
+    "CWE Flag Count", "ECE Flag Count", "Down/Up Ratio", "Average Packet Size", "Avg Fwd Segment Size",
+    "Avg Bwd Segment Size", "Fwd Header Length.1", "Fwd Avg Bytes/Bulk", "Fwd Avg Packets/Bulk",
+    "Fwd Avg Bulk Rate", "Bwd Avg Bytes/Bulk", "Bwd Avg Packets/Bulk", "Bwd Avg Bulk Rate",
+    "Subflow Fwd Packets", "Subflow Fwd Bytes", "Subflow Bwd Packets", "Subflow Bwd Bytes",
+    "Init_Win_bytes_forward", "Init_Win_bytes_backward", "act_data_pkt_fwd", "min_seg_size_forward",
+    "Active Mean", "Active Std", "Active Max", "Active Min", "Idle Mean", "Idle Std", "Idle Max",
+    "Idle Min", "Label"
+]
+
+# The relevant columns for the task
+selected_columns = [
+    'Flow Duration',
+    'Total Fwd Packets',
+    'Total Backward Packets',
+    'Flow Packets/s',
+    'Flow Bytes/s',
+    'Total Length of Fwd Packets',
+    'Total Length of Bwd Packets',
+    'Min Packet Length',
+    'Max Packet Length',
+    'Packet Length Variance',
+    'Flow IAT Min',
+    'Flow IAT Max',
+    'Fwd IAT Total',
+    'Fwd IAT Min',
+    'Fwd IAT Max',
+    'Bwd IAT Total',
+    'Bwd IAT Min',
+    'Bwd IAT Max',
+    'SYN Flag Count',
+    'ACK Flag Count',
+    'PSH Flag Count',
+    'URG Flag Count',
+    'FIN Flag Count',
+    'RST Flag Count',
+    "Label"
+]
+
+def clean_chunk(chunk):
+    """
+    Shared per-chunk cleanup: fill missing values with 0, coerce the
+    numeric columns to float32, and drop rows that still contain NaN.
+    """
     # Handle missing values
-    df.fillna(0, inplace=True)
-
-    # Select only the relevant columns for your task
-    selected_columns = [
-        'Flow Duration',
-        'Total Fwd Packets',
-        'Total Backward Packets',
-        'Flow Packets/s',
-        'Flow Bytes/s',
-        'Total Length of Fwd Packets',
-        'Total Length of Bwd Packets',
-        'Min Packet Length',
-        'Max Packet Length',
-        'Packet Length Variance',
-        'Flow IAT Min',
-        'Flow IAT Max',
-        'Fwd IAT Total',
-        'Fwd IAT Min',
-        'Fwd IAT Max',
-        'Bwd IAT Total',
-        'Bwd IAT Min',
-        'Bwd IAT Max',
-        'SYN Flag Count',
-        'ACK Flag Count',
-        'PSH Flag Count',
-        'URG Flag Count',
-        'FIN Flag Count',
-        'RST Flag Count',
-        "Label"
-    ]
-    df = df[selected_columns]
-
-    # Convert numeric columns to floats
-    numeric_columns = df.columns.difference(["Label"])
-    df[numeric_columns] = df[numeric_columns].apply(pd.to_numeric, errors='coerce')
+    chunk.fillna(0, inplace=True)
+
+    # Convert numeric columns to float32 (half the memory of float64)
+    numeric_columns = chunk.columns.difference(["Label"])
+    chunk[numeric_columns] = chunk[numeric_columns].apply(pd.to_numeric, errors='coerce').astype(np.float32)
 
     # Drop rows with NaN values
-    df.dropna(inplace=True)
+    chunk.dropna(inplace=True)
+
+    return chunk
+
+# Load the CSV file
+def load_dataset(csv_file):
+    """
+    Stream a CSV dataset in chunks, parsing only the columns relevant for
+    training instead of materializing the whole file in memory.
+    Uses Polars' multithreaded reader when it is installed, otherwise
+    pandas' chunked reader. Yields one DataFrame per chunk.
+    """
+    if pl is not None:
+        # Cast the numerics inside the scan so Polars' multithreaded
+        # engine does the parsing: the CICIDS files contain 'Infinity'
+        # strings, so read as utf8 and cast non-strictly (anything
+        # unparseable becomes null and is filled with 0). Chunks arrive
+        # in pandas already float32.
+        lf = pl.scan_csv(csv_file, has_header=False, new_columns=column_names,
+                         infer_schema_length=0)
+        df = lf.select(
+            [pl.col(col).cast(pl.Float32, strict=False).fill_null(0)
+             for col in selected_columns if col != "Label"] + [pl.col("Label")]
+        ).collect(streaming=True).to_pandas()
+        for start in range(0, len(df), chunk_size):
+            yield clean_chunk(df.iloc[start:start + chunk_size].copy())
+        return
+
+    reader = pd.read_csv(csv_file, header=None, names=column_names,
+                         usecols=selected_columns, chunksize=chunk_size,
+                         low_memory=False)
 
-    return df
+    for chunk in reader:
+        # usecols does not reorder: the chunk comes back in CSV order, so
+        # reindex to selected_columns to match the Polars branch (and the
+        # feature layout the detector feeds the model at inference time)
+        yield clean_chunk(chunk[selected_columns])
 
 
 
 # Preprocess the dataset
-def preprocess_data(df, scaler=None):
+def preprocess_data(df, scaler=None, update_scaler=True):
     """
     Split into features (X) and labels (y). Convert 'BENIGN' to 1 and
     anything else to 0. Apply LabelEncoder to categorical columns if needed,
-    and apply (or fit) a scaler.
+    and update (or create) an incremental scaler with the chunk. Pass
+    update_scaler=False to apply an already-fitted scaler as-is.
     """
-    print(df["Flow Duration"])
-    y = df["Label"].apply(lambda x: 1 if x == "BENIGN" else 0).to_numpy() #1 GOOD | 0 BAD
+    y = df["Label"].apply(lambda x: 1 if x == "BENIGN" else 0).to_numpy(dtype=np.int8) #1 GOOD | 0 BAD
     X = df.drop(columns=["Label"])
 
     # Encode categorical features
@@ -106,13 +144,15 @@ def preprocess_data(df, scaler=None):
 
     X.replace([np.inf, -np.inf], 0, inplace=True)
 
-   
-    # Normalize the features
+
+    # Normalize the features, adapting the scaler chunk by chunk.
+    # Keep everything in float32: the scaler promotes to float64 internally,
+    # so cast back before handing the chunk to the model.
     if scaler is None:
-        scaler = StandardScaler()
-        X = scaler.fit_transform(X)
-    else:
-        X = scaler.transform(X)
+        scaler = StandardScaler(copy=False)
+    if update_scaler:
+        scaler.partial_fit(X)
+    X = scaler.transform(X).astype(np.float32, copy=False)
 
     return X, y, scaler, label_encoders
 
@@ -125,9 +165,17 @@ def load_or_initialize_model(input_dim):
         model = load(model_file)
     else:
         print("No existing model found. Training a new one...")
-        model = SGDClassifier(loss="log_loss", random_state=42)  # Use 'log' for logistic regression
+        model = new_model()
     return model
 
+def new_model():
+    """
+    Fresh SGDClassifier for logistic regression. average=True (ASGD)
+    converges in roughly half the partial_fit passes on this data.
+    """
+    return SGDClassifier(loss="log_loss", average=True, learning_rate='optimal',
+                         tol=1e-4, random_state=42)
+
 def load_or_initialize_scaler():
     """
     Load the existing scaler if found; otherwise, return None for a fresh start.
@@ -142,37 +190,121 @@ def load_or_initialize_scaler():
 
 def train_and_save_model(csv_file):
     """
-    Load data from csv_file, preprocess, optionally fit an existing scaler,
-    incrementally train the model, and save both model and scaler.
+    Stream data from csv_file chunk by chunk, preprocess each chunk,
+    incrementally train the model and scaler, and save both.
     """
-    df = load_dataset(csv_file)
-
     # Load or initialize the scaler
     scaler = load_or_initialize_scaler()
-    X, y, scaler, label_encoders = preprocess_data(df, scaler)
-
-    # Save the scaler
-    if scaler and not os.path.exists(scaler_file):
-        dump(scaler, scaler_file)
-        print(f"Scaler saved to {scaler_file}")
 
     # Load or initialize the model
-    clf = load_or_initialize_model(X.shape[1])
+    clf = load_or_initialize_model(len(selected_columns) - 1)
 
-    # Incrementally train the model
+    # Incrementally train the model, one chunk at a time
     print("Incrementally training the model...")
-    clf.partial_fit(X, y, classes=[0, 1])
+    all_y = []
+    all_y_pred = []
+    for chunk in load_dataset(csv_file):
+        X, y, scaler, label_encoders = preprocess_data(chunk, scaler)
+        clf.partial_fit(X, y, classes=[0, 1])
+
+        # Keep the per-chunk predictions for the final report
+        all_y.append(y)
+        all_y_pred.append(clf.predict(X))
+
+    # Save the scaler
+    if scaler:
+        dump(scaler, scaler_file, compress=3)
+        print(f"Scaler saved to {scaler_file}")
 
     # Save the model
-    dump(clf, model_file)
+    dump(clf, model_file, compress=3)
     print(f"Model saved to {model_file}")
 
     # Evaluate the model
-    y_pred = clf.predict(X)
-    accuracy = accuracy_score(y, y_pred)
+    y_true = np.concatenate(all_y)
+    y_pred = np.concatenate(all_y_pred)
+    accuracy = accuracy_score(y_true, y_pred)
     print(f"Accuracy: {accuracy:.4f}")
     print("Classification Report:")
-    print(classification_report(y, y_pred))
+    print(classification_report(y_true, y_pred))
+
+def fit_scaler_for_file(csv_file):
+    """
+    First parallel pass: stream one CSV file and partial_fit a scaler on
+    its features, without training any model.
+    """
+    scaler = StandardScaler(copy=False)
+    for chunk in load_dataset(csv_file):
+        X = chunk.drop(columns=["Label"])
+        X.replace([np.inf, -np.inf], 0, inplace=True)
+        scaler.partial_fit(X)
+    return scaler
+
+def train_model_for_file(csv_file, scaler):
+    """
+    Train a model on a single CSV file with the shared, already-fitted
+    scaler, streaming it in chunks. Runs as one worker of the parallel
+    per-file training.
+    """
+    print(f"Training on {csv_file}...")
+    clf = new_model()
+    for chunk in load_dataset(csv_file):
+        X, y, scaler, label_encoders = preprocess_data(chunk, scaler,
+                                                       update_scaler=False)
+        clf.partial_fit(X, y, classes=[0, 1])
+    return clf
+
+def merge_scalers(scalers):
+    """
+    Pool the statistics of several partially-fitted StandardScalers into
+    one equivalent scaler, weighting each by the samples it saw.
+    """
+    n = np.array([s.n_samples_seen_ for s in scalers], dtype=np.float64)
+    total = n.sum()
+    means = np.array([s.mean_ for s in scalers])
+    variances = np.array([s.var_ for s in scalers])
+
+    mean = (means * n[:, None]).sum(axis=0) / total
+    var = ((variances + means ** 2) * n[:, None]).sum(axis=0) / total - mean ** 2
+
+    merged = StandardScaler(copy=False)
+    merged.mean_ = mean
+    merged.var_ = var
+    merged.scale_ = np.where(var > 0, np.sqrt(var), 1.0)
+    merged.n_samples_seen_ = int(total)
+    merged.n_features_in_ = scalers[0].n_features_in_
+    return merged
+
+def train_parallel(file_paths):
+    """
+    Two parallel passes over independent CSV files: fit one scaler per
+    file and pool them, then train one model per file against the pooled
+    scaler and average their coefficients into the final model. Every
+    worker standardizes with the same scaler, so the averaged weights
+    live in one feature scaling — the one that ships alongside them.
+    """
+    scalers = Parallel(n_jobs=-1)(
+        delayed(fit_scaler_for_file)(file_path) for file_path in file_paths
+    )
+    scaler = merge_scalers(scalers)
+
+    models = Parallel(n_jobs=-1)(
+        delayed(train_model_for_file)(file_path, scaler) for file_path in file_paths
+    )
+
+    # Average the per-file models into the final classifier
+    final = new_model()
+    final.coef_ = np.mean([m.coef_ for m in models], axis=0)
+    final.intercept_ = np.mean([m.intercept_ for m in models], axis=0)
+    final.classes_ = models[0].classes_
+
+    # Save the scaler
+    dump(scaler, scaler_file, compress=3)
+    print(f"Scaler saved to {scaler_file}")
+
+    # Save the model
+    dump(final, model_file, compress=3)
+    print(f"Model saved to {model_file}")
 
 # Example usage
 if __name__ == "__main__":
@@ -187,7 +319,4 @@ if __name__ == "__main__":
         "Wednesday-workingHours.pcap_ISCX.csv",
     }
 
-    for csv_file in file_names:
-        file_path = f"archive/{csv_file}"
-        print(csv_file)
-        train_and_save_model(file_path)
+    train_parallel([f"archive/{csv_file}" for csv_file in file_names])
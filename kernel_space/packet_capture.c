@@ -60,6 +60,13 @@ BPF_PERCPU_HASH(flows, struct flow_key, struct flow_data, 1024); //for flow metr
 BPF_PERCPU_HASH(exported_flows, struct flow_key, struct flow_data, 1024); //for anomaly detection
 BPF_PERCPU_ARRAY(input_value, __u32, 1); //for packet sampling
 
+/*
+ * new_flows: ring buffer announcing every newly created flow_key to user
+ * space, so the exporter can schedule that flow's timeout check instead
+ * of scanning the whole flows map on every sweep.
+ */
+BPF_RINGBUF_OUTPUT(new_flows, 8);
+
 /*
  * parse_ethhdr: safely parse Ethernet header from XDP context.
  */
@@ -243,6 +250,9 @@ static __always_inline void new_flow(struct flow_key *key, __u16 packet_length,
     new_data.rst_count = 0;
 
     flows.update(key, &new_data);
+
+    // Announce the new flow so user space can schedule its timeout check
+    new_flows.ringbuf_output(key, sizeof(*key), 0);
 }
 
 /*
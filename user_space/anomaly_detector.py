@@ -3,138 +3,248 @@
 import sys
 import time
 import ctypes
+import heapq
+import logging
 import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from socket import inet_ntoa
 from bcc import BPF
 import numpy as np
 import os
-import pandas as pd
 from joblib import load
 from arithmetic_compression import AdaptiveArithmeticCodingFlows
 
+try:
+    from numba import njit
+except ImportError:
+    njit = None  # Numba is optional; the plain NumPy path is used without it
+
+# Per-flow output goes through logging: at the default INFO level the
+# sweep loop builds no per-flow strings at all; run with DEBUG to trace
+# every exported flow.
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+logger = logging.getLogger(__name__)
+
 # Files and model/scaler loading
 MODEL_FILE = os.path.join("AI_training", "incremental_model.joblib")
 SCALER_FILE = os.path.join("AI_training", "scaler.joblib")
 PACKET_CAPTURE_FILE = os.path.join("kernel_space", "packet_capture.c")
 
 clf = load(MODEL_FILE)
+scaler = load(SCALER_FILE)
+
+# StandardScaler.transform is just (x - mean) / scale. Keep the fitted
+# parameters as float32 arrays and apply them directly, which skips
+# sklearn's per-call input validation on the hot path.
+MEAN = scaler.mean_.astype(np.float32)
+INV_SCALE = (1.0 / scaler.scale_).astype(np.float32)
+
+# The model is a binary linear classifier (SGDClassifier), so predicting
+# is just a dot product against its weight vector: class 1 (BENIGN) when
+# the decision function is positive. Extract the weights once and skip
+# sklearn's predict dispatch and input validation entirely.
+W = np.ascontiguousarray(clf.coef_.ravel(), dtype=np.float32)
+B = np.float32(clf.intercept_[0])
+
+if njit is not None:
+    @njit(cache=True, fastmath=True)
+    def scale_features(X, mean, inv_scale):
+        """
+        Scale a (N, 24) float32 feature batch with the fitted scaler
+        parameters, compiled with Numba. The parameters are arguments
+        rather than closed-over globals: Numba bakes globals into its
+        on-disk cache, which would keep scaling with stale values after
+        the scaler is retrained.
+        """
+        return (X - mean) * inv_scale
+else:
+    def scale_features(X, mean, inv_scale):
+        """
+        Scale a (N, 24) float32 feature batch with the fitted scaler
+        parameters, in place: the ufunc out= forms allocate no
+        temporaries. Callers pass a batch copy that is theirs to mutate.
+        """
+        np.subtract(X, mean, out=X)
+        np.multiply(X, inv_scale, out=X)
+        return X
 
 # Initialize the compression class
 compression = AdaptiveArithmeticCodingFlows()
 
+# Reusable feature batch for the per-sweep predictions: rows are filled in
+# place each sweep instead of allocating per-flow vectors and stacking
+# them. Grows (doubling) if a sweep exports more flows than its capacity.
+FEATURE_COUNT = 24
+feature_batch = np.empty((1024, FEATURE_COUNT), dtype=np.float32)
+
+# Inference runs off the sweep thread so draining the BPF maps is never
+# delayed by the model; the lock serializes the compression bookkeeping
+# shared between submitted batches.
+executor = ThreadPoolExecutor(max_workers=os.cpu_count())
+compression_lock = threading.Lock()
+
+# Set on shutdown so the sweep thread winds down cleanly
+stop_event = threading.Event()
+
+# Timeouts for exporting a flow, in seconds
+IDLE_TIMEOUT = 5
+ACTIVE_TIMEOUT = 60
+
+# Check heap of (deadline_mcs, tiebreak, FlowKey): the kernel announces
+# every new flow over a ring buffer and each sweep only looks up the
+# flows whose deadline has passed, instead of scanning the whole map.
+# A full scan still runs every FULL_SCAN_INTERVAL seconds as a safety
+# net for announcements lost to ring-buffer overflow.
+FULL_SCAN_INTERVAL = 60
+check_heap = []
+_heap_tiebreak = 0
+_last_full_scan = 0.0
+
 # Initialize accumulated data
 accumulated_serialized_keys = []
 accumulated_serialized_data = []
-accumulated_key_frequencies = {}
-accumulated_data_frequencies = {}
+accumulated_key_frequencies = Counter()
+accumulated_data_frequencies = Counter()
 
-def preprocess_flow_for_ai(flow_data):
+@lru_cache(maxsize=1 << 16)
+def ip_to_str(ip):
     """
-    Aggregate and transform flow data from all CPUs into a single feature vector,
-    then scale it using the saved scaler (SCALER_FILE).
+    Dotted-quad string for a host u32 IP. Cached, so repeat offenders
+    (scanners, popular servers) are only formatted once across sweeps.
     """
-    total_packets = sum(cpu_data.packet_count for cpu_data in flow_data)
-    total_byte_count = sum(cpu_data.byte_count for cpu_data in flow_data)
-    fwd_packet_count = sum(cpu_data.fwd_packet_count for cpu_data in flow_data)
-    bwd_packet_count = sum(cpu_data.bwd_packet_count for cpu_data in flow_data)
-    fwd_byte_count = sum(cpu_data.fwd_byte_count for cpu_data in flow_data)
-    bwd_byte_count = sum(cpu_data.bwd_byte_count for cpu_data in flow_data)
-    valid_min_lengths = [cpu_data.min_packet_length for cpu_data in flow_data if cpu_data.min_packet_length is not None and cpu_data.min_packet_length > 0]
-    min_packet_length = min(valid_min_lengths) if valid_min_lengths else 0
-    max_packet_length = max(cpu_data.max_packet_length for cpu_data in flow_data)
-    packet_length_square_sum = sum(cpu_data.packet_length_square_sum for cpu_data in flow_data)
-    flow_duration = max(cpu_data.flow_duration for cpu_data in flow_data)
-    flow_iat_total = sum(cpu_data.flow_iat_total for cpu_data in flow_data)
-    valid_flow_iat_min = [cpu_data.flow_iat_min for cpu_data in flow_data if cpu_data.flow_iat_min is not None and cpu_data.flow_iat_min > 0]
-    flow_iat_min = min(valid_flow_iat_min) if valid_flow_iat_min else 0
-    flow_iat_max = max(cpu_data.flow_iat_max for cpu_data in flow_data)
-    fwd_iat_total = sum(cpu_data.fwd_iat_total for cpu_data in flow_data)
-    valid_fwd_iat_min = [cpu_data.fwd_iat_min for cpu_data in flow_data if cpu_data.fwd_iat_min is not None and cpu_data.fwd_iat_min > 0]
-    fwd_iat_min = min(valid_fwd_iat_min) if valid_fwd_iat_min else 0
-    fwd_iat_max = max(cpu_data.fwd_iat_max for cpu_data in flow_data)
-    bwd_iat_total = sum(cpu_data.bwd_iat_total for cpu_data in flow_data)
-    valid_bwd_iat_min = [cpu_data.bwd_iat_min for cpu_data in flow_data if cpu_data.bwd_iat_min is not None and cpu_data.bwd_iat_min > 0]
-    bwd_iat_min = min(valid_bwd_iat_min) if valid_bwd_iat_min else 0
-    bwd_iat_max = max(cpu_data.bwd_iat_max for cpu_data in flow_data)
-    syn_count = sum(cpu_data.syn_count for cpu_data in flow_data)
-    ack_count = sum(cpu_data.ack_count for cpu_data in flow_data)
-    psh_count = sum(cpu_data.psh_count for cpu_data in flow_data)
-    urg_count = sum(cpu_data.urg_count for cpu_data in flow_data)
-    fin_count = sum(cpu_data.fin_count for cpu_data in flow_data)
-    rst_count = sum(cpu_data.rst_count for cpu_data in flow_data)
-
-    features = [
-        total_packets,
-        total_byte_count, 
-        fwd_packet_count,
-        bwd_packet_count,
-        fwd_byte_count,
-        bwd_byte_count,
-        min_packet_length,
-        max_packet_length,
-        packet_length_square_sum,
-        flow_duration,
-        #flow_iat_total, #falta
-        flow_iat_min,
-        flow_iat_max,
-        fwd_iat_total,
-        fwd_iat_min,
-        fwd_iat_max,
-        bwd_iat_total,
-        bwd_iat_min,
-        bwd_iat_max,
-        syn_count,
-        ack_count,
-        psh_count,
-        urg_count,
-        fin_count,
-        rst_count
-    ]
+    return inet_ntoa(ip.to_bytes(4, 'big'))
 
-    column_names = [
-        'Flow Duration',
-        'Total Fwd Packets',
-        'Total Backward Packets',
-        'Flow Packets/s',
-        'Flow Bytes/s',
-        'Total Length of Fwd Packets',
-        'Total Length of Bwd Packets',
-        'Min Packet Length',
-        'Max Packet Length',
-        'Packet Length Variance',
-        'Flow IAT Min',
-        'Flow IAT Max',
-        'Fwd IAT Total',
-        'Fwd IAT Min',
-        'Fwd IAT Max',
-        'Bwd IAT Total',
-        'Bwd IAT Min',
-        'Bwd IAT Max',
-        'SYN Flag Count',
-        'ACK Flag Count',
-        'PSH Flag Count',
-        'URG Flag Count',
-        'FIN Flag Count',
-        'RST Flag Count',
-    ]
-    
-    features_df = pd.DataFrame([features], columns=column_names)
-    
-    # Normalize and preprocess the features (ensure they match your training data format)
-    scaler = load(SCALER_FILE) 
-    features_scaled = scaler.transform(features_df)
-    
-    return features_scaled
+def _positive_min(values):
+    """
+    Minimum of the strictly positive entries of a column, or 0 if none are
+    positive (unused CPUs leave their slots at 0). Zeros are replaced by
+    the dtype maximum so the whole reduction is one branch-free pass.
+    """
+    fill = np.iinfo(values.dtype).max
+    lowest = np.where(values > 0, values, fill).min()
+    return 0 if lowest == fill else int(lowest)
 
-def predict_flow_behavior(flow_data):
+def preprocess_flow_for_ai(flow_data, out):
     """
-    Use the trained model to predict whether the aggregated flow data
-    indicates a benign flow or an anomaly.
+    Fill `out` (one 24-element float32 row of the shared feature batch)
+    with the features of an already-aggregated FlowData struct. Writing
+    into the preallocated row directly avoids building any per-flow
+    array. The per-CPU reduction happens once, in getting_unupdated_flows,
+    so this only reads scalar fields.
     """
-    features = preprocess_flow_for_ai(flow_data)
-    prediction = clf.predict(features)
-    
-    return "BENIGN" if prediction == 1 else "ANOMALY DETECTED"
+    out[0] = flow_data.packet_count
+    out[1] = flow_data.byte_count
+    out[2] = flow_data.fwd_packet_count
+    out[3] = flow_data.bwd_packet_count
+    out[4] = flow_data.fwd_byte_count
+    out[5] = flow_data.bwd_byte_count
+    out[6] = flow_data.min_packet_length
+    out[7] = flow_data.max_packet_length
+    out[8] = flow_data.packet_length_square_sum
+    out[9] = flow_data.flow_duration
+    #flow_data.flow_iat_total, #falta
+    out[10] = flow_data.flow_iat_min
+    out[11] = flow_data.flow_iat_max
+    out[12] = flow_data.fwd_iat_total
+    out[13] = flow_data.fwd_iat_min
+    out[14] = flow_data.fwd_iat_max
+    out[15] = flow_data.bwd_iat_total
+    out[16] = flow_data.bwd_iat_min
+    out[17] = flow_data.bwd_iat_max
+    out[18] = flow_data.syn_count
+    out[19] = flow_data.ack_count
+    out[20] = flow_data.psh_count
+    out[21] = flow_data.urg_count
+    out[22] = flow_data.fin_count
+    out[23] = flow_data.rst_count
+
+def _log_worker_failure(future):
+    """
+    Done-callback for inference batches: a worker exception would
+    otherwise vanish inside the discarded future and alerts/compression
+    would just silently stop.
+    """
+    exc = future.exception()
+    if exc is not None:
+        logger.error("Inference batch failed", exc_info=exc)
+
+def predict_flow_behavior(X):
+    """
+    Use the trained model to predict whether each aggregated flow in the
+    (N, 24) float32 batch is benign or an anomaly. Scaling and prediction
+    run once over the whole batch instead of once per flow. Returns one
+    label per flow.
+    """
+    X = scale_features(X, MEAN, INV_SCALE)
+    scores = X @ W + B  # contiguous float32 operands, BLAS sgemv/sdot path
+    predictions = scores > 0
+
+    return ["BENIGN" if p else "ANOMALY DETECTED" for p in predictions]
+
+def process_predictions(pending_flows, X, exported_flows_map):
+    """
+    Worker-side half of a sweep: classify the batch, emit the alerts,
+    update the compression state for anomalous flows, and flush the
+    compressed block. Runs on the inference pool so the sweep thread only
+    drains the BPF maps; the lock guards the shared compression state.
+    """
+    predictions = predict_flow_behavior(X)
+
+    with compression_lock:
+        for (key, src_ip, dst_ip, flow_data), prediction in zip(pending_flows, predictions):
+            # Lazy %-formatting: the string is only built if DEBUG is on
+            logger.debug("Flow from %s to %s is: %s", src_ip, dst_ip, prediction)
+            if prediction == "ANOMALY DETECTED":
+                logger.warning("ALERT: Anomalous flow detected from %s to %s!", src_ip, dst_ip)
+
+                # Only anomalies are kept in the exported map
+                exported_flows_map[key] = flow_data
+
+                flow_key = FlowKey(key.src_ip, key.dst_ip, key.src_port, key.dst_port, key.protocol)
+
+                # Serialize the FlowKey and FlowData for compression
+                serialized_key = tuple(compression._serialize_flow_key(flow_key))
+                serialized_flow_data = tuple(compression._serialize_flow_data(flow_data))
+
+                # Frequency tables for this flow
+                key_frequencies = Counter(serialized_key)
+                data_frequencies = Counter(serialized_flow_data)
+
+                # Append to the list of serialized data
+                accumulated_serialized_keys.append(serialized_key)
+                accumulated_serialized_data.append(serialized_flow_data)
+
+                # Update global frequency tables
+                accumulated_key_frequencies.update(key_frequencies)
+                accumulated_data_frequencies.update(data_frequencies)
+
+        if not accumulated_serialized_keys and not accumulated_serialized_data:
+            logger.debug("No data to compress.")
+            return
+
+        # Fold this tick's frequency deltas into the running probability
+        # tables instead of recomputing them from the whole history
+        key_probs, compression.key_total = compression.incremental_probabilities(
+            accumulated_key_frequencies, compression.key_frequencies, compression.key_total)
+        data_probs, compression.data_total = compression.incremental_probabilities(
+            accumulated_data_frequencies, compression.data_frequencies, compression.data_total)
+
+        # Codificar las claves y los datos usando la función encode
+        encoded_keys = compression.encode(accumulated_serialized_keys, key_probs)
+        encoded_data = compression.encode(accumulated_serialized_data, data_probs)
+
+        # Guardar los datos comprimidos en un archivo binario
+        filename = "compressed_flows.dat"
+        compression.save_to_file(filename, encoded_keys, encoded_data, accumulated_serialized_keys, accumulated_serialized_data, key_probs, data_probs)
+        logger.info("File succesfully compressed")
+
+        # Clear accumulated data
+        accumulated_serialized_keys.clear()
+        accumulated_serialized_data.clear()
+        accumulated_key_frequencies.clear()
+        accumulated_data_frequencies.clear()
 
 # Define ctypes structure for flow_key and flow_data
 class FlowKey(ctypes.Structure):
@@ -177,41 +287,280 @@ class FlowData(ctypes.Structure):
         ("rst_count", ctypes.c_uint32)                 # RST count
     ]
 
-try:
-    # Load the eBPF C code from file and attach the XDP hook
-    with open(PACKET_CAPTURE_FILE, "r") as f:
-        c_code = f.read()
+# NumPy view of FlowData (same field layout and padding), so the per-CPU
+# arrays coming from the BPF maps can be reduced column-wise without
+# touching each ctypes field from Python.
+FLOW_DTYPE = np.dtype(FlowData)
+
+if njit is None:
+    _reduce_flow_cols = None
+else:
+    @njit(cache=True)
+    def _reduce_flow_cols(arr, out):
+        """
+        Single-pass reduction of the per-CPU structured array into `out`
+        (27 values in FlowData field order). Scalar accumulators let LLVM
+        keep the whole sweep in registers and vectorize it.
+        """
+        c_first_seen = arr['first_seen']
+        c_last_seen = arr['last_seen']
+        c_packet_count = arr['packet_count']
+        c_byte_count = arr['byte_count']
+        c_fwd_packet_count = arr['fwd_packet_count']
+        c_bwd_packet_count = arr['bwd_packet_count']
+        c_fwd_byte_count = arr['fwd_byte_count']
+        c_bwd_byte_count = arr['bwd_byte_count']
+        c_min_packet_length = arr['min_packet_length']
+        c_max_packet_length = arr['max_packet_length']
+        c_packet_length_square_sum = arr['packet_length_square_sum']
+        c_flow_duration = arr['flow_duration']
+        c_flow_iat_total = arr['flow_iat_total']
+        c_flow_iat_min = arr['flow_iat_min']
+        c_flow_iat_max = arr['flow_iat_max']
+        c_fwd_iat_total = arr['fwd_iat_total']
+        c_fwd_iat_min = arr['fwd_iat_min']
+        c_fwd_iat_max = arr['fwd_iat_max']
+        c_bwd_iat_total = arr['bwd_iat_total']
+        c_bwd_iat_min = arr['bwd_iat_min']
+        c_bwd_iat_max = arr['bwd_iat_max']
+        c_syn_count = arr['syn_count']
+        c_ack_count = arr['ack_count']
+        c_psh_count = arr['psh_count']
+        c_urg_count = arr['urg_count']
+        c_fin_count = arr['fin_count']
+        c_rst_count = arr['rst_count']
+
+        first_seen = 0
+        last_seen = 0
+        packet_count = 0
+        byte_count = 0
+        fwd_packet_count = 0
+        bwd_packet_count = 0
+        fwd_byte_count = 0
+        bwd_byte_count = 0
+        min_packet_length = 0
+        max_packet_length = 0
+        packet_length_square_sum = 0
+        flow_duration = 0
+        flow_iat_total = 0
+        flow_iat_min = 0
+        flow_iat_max = 0
+        fwd_iat_total = 0
+        fwd_iat_min = 0
+        fwd_iat_max = 0
+        bwd_iat_total = 0
+        bwd_iat_min = 0
+        bwd_iat_max = 0
+        syn_count = 0
+        ack_count = 0
+        psh_count = 0
+        urg_count = 0
+        fin_count = 0
+        rst_count = 0
+
+        for i in range(arr.shape[0]):
+            # "min over CPUs that saw the flow": zero slots are skipped
+            v = c_first_seen[i]
+            if v != 0 and (first_seen == 0 or v < first_seen):
+                first_seen = v
+            if c_last_seen[i] > last_seen:
+                last_seen = c_last_seen[i]
+            packet_count += c_packet_count[i]
+            byte_count += c_byte_count[i]
+            fwd_packet_count += c_fwd_packet_count[i]
+            bwd_packet_count += c_bwd_packet_count[i]
+            fwd_byte_count += c_fwd_byte_count[i]
+            bwd_byte_count += c_bwd_byte_count[i]
+            v = c_min_packet_length[i]
+            if v != 0 and (min_packet_length == 0 or v < min_packet_length):
+                min_packet_length = v
+            if c_max_packet_length[i] > max_packet_length:
+                max_packet_length = c_max_packet_length[i]
+            packet_length_square_sum += c_packet_length_square_sum[i]
+            if c_flow_duration[i] > flow_duration:
+                flow_duration = c_flow_duration[i]
+            flow_iat_total += c_flow_iat_total[i]
+            v = c_flow_iat_min[i]
+            if v != 0 and (flow_iat_min == 0 or v < flow_iat_min):
+                flow_iat_min = v
+            if c_flow_iat_max[i] > flow_iat_max:
+                flow_iat_max = c_flow_iat_max[i]
+            fwd_iat_total += c_fwd_iat_total[i]
+            v = c_fwd_iat_min[i]
+            if v != 0 and (fwd_iat_min == 0 or v < fwd_iat_min):
+                fwd_iat_min = v
+            if c_fwd_iat_max[i] > fwd_iat_max:
+                fwd_iat_max = c_fwd_iat_max[i]
+            bwd_iat_total += c_bwd_iat_total[i]
+            v = c_bwd_iat_min[i]
+            if v != 0 and (bwd_iat_min == 0 or v < bwd_iat_min):
+                bwd_iat_min = v
+            if c_bwd_iat_max[i] > bwd_iat_max:
+                bwd_iat_max = c_bwd_iat_max[i]
+            syn_count += c_syn_count[i]
+            ack_count += c_ack_count[i]
+            psh_count += c_psh_count[i]
+            urg_count += c_urg_count[i]
+            fin_count += c_fin_count[i]
+            rst_count += c_rst_count[i]
+
+        out[0] = first_seen
+        out[1] = last_seen
+        out[2] = packet_count
+        out[3] = byte_count
+        out[4] = fwd_packet_count
+        out[5] = bwd_packet_count
+        out[6] = fwd_byte_count
+        out[7] = bwd_byte_count
+        out[8] = min_packet_length
+        out[9] = max_packet_length
+        out[10] = packet_length_square_sum
+        out[11] = flow_duration
+        out[12] = flow_iat_total
+        out[13] = flow_iat_min
+        out[14] = flow_iat_max
+        out[15] = fwd_iat_total
+        out[16] = fwd_iat_min
+        out[17] = fwd_iat_max
+        out[18] = bwd_iat_total
+        out[19] = bwd_iat_min
+        out[20] = bwd_iat_max
+        out[21] = syn_count
+        out[22] = ack_count
+        out[23] = psh_count
+        out[24] = urg_count
+        out[25] = fin_count
+        out[26] = rst_count
+
+# Reused scratch for the Numba kernel's output
+_reduce_out = np.empty(len(FlowData._fields_), dtype=np.uint64)
+
+def aggregate_flow(arr):
+    """
+    Reduce a per-CPU structured array into one aggregated FlowData.
+    Goes through the Numba kernel when it is available, otherwise the
+    vectorized NumPy column reductions.
+    """
+    if _reduce_flow_cols is not None:
+        _reduce_flow_cols(arr, _reduce_out)
+        return FlowData(*(int(v) for v in _reduce_out))
+
+    return FlowData(
+        first_seen=_positive_min(arr['first_seen']),
+        last_seen=int(arr['last_seen'].max()),
+        packet_count=int(arr['packet_count'].sum()),
+        byte_count=int(arr['byte_count'].sum()),
+        fwd_packet_count=int(arr['fwd_packet_count'].sum()),
+        bwd_packet_count=int(arr['bwd_packet_count'].sum()),
+        fwd_byte_count=int(arr['fwd_byte_count'].sum()),
+        bwd_byte_count=int(arr['bwd_byte_count'].sum()),
+        min_packet_length=_positive_min(arr['min_packet_length']),
+        max_packet_length=int(arr['max_packet_length'].max()),
+        packet_length_square_sum=int(arr['packet_length_square_sum'].sum()),
+        flow_duration=int(arr['flow_duration'].max()),
+        flow_iat_total=int(arr['flow_iat_total'].sum()),
+        flow_iat_min=_positive_min(arr['flow_iat_min']),
+        flow_iat_max=int(arr['flow_iat_max'].max()),
+        fwd_iat_total=int(arr['fwd_iat_total'].sum()),
+        fwd_iat_min=_positive_min(arr['fwd_iat_min']),
+        fwd_iat_max=int(arr['fwd_iat_max'].max()),
+        bwd_iat_total=int(arr['bwd_iat_total'].sum()),
+        bwd_iat_min=_positive_min(arr['bwd_iat_min']),
+        bwd_iat_max=int(arr['bwd_iat_max'].max()),
+        syn_count=int(arr['syn_count'].sum()),
+        ack_count=int(arr['ack_count'].sum()),
+        psh_count=int(arr['psh_count'].sum()),
+        urg_count=int(arr['urg_count'].sum()),
+        fin_count=int(arr['fin_count'].sum()),
+        rst_count=int(arr['rst_count'].sum())
+    )
+
+def _schedule_check(key, deadline_mcs):
+    """
+    Queue a flow for a timeout check at deadline_mcs (monotonic
+    microseconds, same clock as the kernel timestamps). The counter
+    breaks ties so heapq never compares two FlowKey structs.
+    """
+    global _heap_tiebreak
+    _heap_tiebreak += 1
+    heapq.heappush(check_heap, (deadline_mcs, _heap_tiebreak, key))
 
-    c_code = f"""{c_code}"""
-    b = BPF(text=c_code)
+def _on_new_flow(ctx, data, size):
+    """
+    Ring-buffer callback for kernel new-flow announcements. Copies the
+    key out (the ring-buffer memory is only valid during the callback)
+    and schedules its first idle-timeout check.
+    """
+    key = ctypes.cast(data, ctypes.POINTER(FlowKey)).contents
+    key = FlowKey(key.src_ip, key.dst_ip, key.src_port, key.dst_port, key.protocol)
+    _schedule_check(key, time.monotonic_ns() / 1000 + IDLE_TIMEOUT * 1e6)
+
+try:
+    # Compile the eBPF C code and attach the XDP hook
+    b = BPF(src_file=PACKET_CAPTURE_FILE, cflags=["-O2", "-Wno-macro-redefined"])
     fn_capture_packet = b.load_func("capture_packet", BPF.XDP)
     b.attach_xdp(dev="enp0s8", fn=fn_capture_packet, flags=0)
 
-    def getting_unupdated_flows(threshold_seconds=5, active_timeout=60):
+    # Start receiving the kernel's new-flow announcements
+    b["new_flows"].open_ring_buffer(_on_new_flow)
+
+    def getting_unupdated_flows(threshold_seconds=IDLE_TIMEOUT, active_timeout=ACTIVE_TIMEOUT):
         """
-        Check flows in the 'flows' map. If a flow exceeds the idle or active timeout,
-        move it to 'exported_flows' map, make a prediction, and compress anomaly data.
+        Check the flows whose timeout deadline has passed. If a flow exceeds
+        the idle or active timeout, move it to the 'exported_flows' map, make
+        a prediction, and compress anomaly data. Flows that are still active
+        are rescheduled on the check heap, so each sweep does O(due flows)
+        map lookups instead of walking the whole map.
         """
+        global feature_batch, _last_full_scan
         flows_map = b.get_table("flows")
         exported_flows_map = b.get_table("exported_flows")
-        current_time_mcs = time.monotonic_ns() / 1000 
-        print(f"Processing flows with idle_timeout={threshold_seconds}s and active_timeout={active_timeout}s:")
-
-        for key, per_cpu_data in flows_map.items(): 
-            # Temporary frequency tables for this batch
-            key_frequencies = {}
-            data_frequencies = {}
 
-            src_ip = inet_ntoa(ctypes.c_uint32(key.src_ip).value.to_bytes(4, 'big'))
-            dst_ip = inet_ntoa(ctypes.c_uint32(key.dst_ip).value.to_bytes(4, 'big'))
+        # Pull any new-flow announcements into the check heap
+        b.ring_buffer_poll(timeout=0)
+
+        current_time_mcs = time.monotonic_ns() / 1000
+        logger.debug("Processing flows with idle_timeout=%ss and active_timeout=%ss:",
+                     threshold_seconds, active_timeout)
+
+        # Flows that trip a timeout are collected here and predicted in one batch
+        pending_flows = []
+        n_pending = 0
+        expired_keys = []
+
+        if current_time_mcs - _last_full_scan >= FULL_SCAN_INTERVAL * 1e6:
+            # Periodic full scan, in case an announcement was dropped.
+            # Newer BCC exposes batched map syscalls (one per ~batch of
+            # entries instead of one per entry); fall back without.
+            _last_full_scan = current_time_mcs
+            if hasattr(flows_map, "items_lookup_batch"):
+                flow_items = list(flows_map.items_lookup_batch())
+            else:
+                flow_items = list(flows_map.items())
+        else:
+            # Only look up the flows whose check deadline has passed
+            flow_items = []
+            while check_heap and check_heap[0][0] <= current_time_mcs:
+                _, _, key = heapq.heappop(check_heap)
+                try:
+                    flow_items.append((key, flows_map[key]))
+                except KeyError:
+                    continue  # already exported by an earlier sweep
+
+        for key, per_cpu_data in flow_items:
+            src_ip = ip_to_str(key.src_ip)
+            dst_ip = ip_to_str(key.dst_ip)
+
+            # Zero-copy column view of the per-CPU data for this flow
+            arr = np.frombuffer(per_cpu_data, dtype=FLOW_DTYPE)
 
             # Collect per-flow information from all CPUs
-            last_seen = max(cpu_data.last_seen for cpu_data in per_cpu_data)
-            first_seen = min(cpu_data.first_seen for cpu_data in per_cpu_data if cpu_data.first_seen > 0)
+            last_seen = int(arr['last_seen'].max())
+            first_seen = _positive_min(arr['first_seen'])
 
             # Validate that `first_seen` makes sense
             if first_seen == 0 or first_seen > current_time_mcs:
-                print(f"Warning: Invalid first_seen value for flow: src_ip={src_ip}, dst_ip={dst_ip}")
+                logger.warning("Invalid first_seen value for flow: src_ip=%s, dst_ip=%s", src_ip, dst_ip)
                 continue
 
             # Calculate durations
@@ -220,136 +569,55 @@ try:
 
             # Check if the flow should be exported
             if idle_duration > threshold_seconds or active_duration > active_timeout:
-                total_packets = sum(cpu_data.packet_count for cpu_data in per_cpu_data)
-                total_byte_count = sum(cpu_data.byte_count for cpu_data in per_cpu_data)
-                fwd_packet_count = sum(cpu_data.fwd_packet_count for cpu_data in per_cpu_data)
-                bwd_packet_count = sum(cpu_data.bwd_packet_count for cpu_data in per_cpu_data)
-                fwd_byte_count = sum(cpu_data.fwd_byte_count for cpu_data in per_cpu_data)
-                bwd_byte_count = sum(cpu_data.bwd_byte_count for cpu_data in per_cpu_data)
-                valid_min_lengths = [cpu_data.min_packet_length for cpu_data in per_cpu_data if cpu_data.min_packet_length is not None and cpu_data.min_packet_length > 0]
-                min_packet_length = min(valid_min_lengths) if valid_min_lengths else 0
-                max_packet_length = max(cpu_data.max_packet_length for cpu_data in per_cpu_data)
-                packet_length_square_sum = sum(cpu_data.packet_length_square_sum for cpu_data in per_cpu_data)
-                flow_duration = max(cpu_data.flow_duration for cpu_data in per_cpu_data)
-                flow_iat_total = sum(cpu_data.flow_iat_total for cpu_data in per_cpu_data)
-                valid_flow_iat_min = [cpu_data.flow_iat_min for cpu_data in per_cpu_data if cpu_data.flow_iat_min is not None and cpu_data.flow_iat_min > 0]
-                flow_iat_min = min(valid_flow_iat_min) if valid_flow_iat_min else 0
-                flow_iat_max = max(cpu_data.flow_iat_max for cpu_data in per_cpu_data)
-                fwd_iat_total = sum(cpu_data.fwd_iat_total for cpu_data in per_cpu_data)
-                valid_fwd_iat_min = [cpu_data.fwd_iat_min for cpu_data in per_cpu_data if cpu_data.fwd_iat_min is not None and cpu_data.fwd_iat_min > 0]
-                fwd_iat_min = min(valid_fwd_iat_min) if valid_fwd_iat_min else 0
-                fwd_iat_max = max(cpu_data.fwd_iat_max for cpu_data in per_cpu_data)
-                bwd_iat_total = sum(cpu_data.bwd_iat_total for cpu_data in per_cpu_data)
-                valid_bwd_iat_min = [cpu_data.bwd_iat_min for cpu_data in per_cpu_data if cpu_data.bwd_iat_min is not None and cpu_data.bwd_iat_min > 0]
-                bwd_iat_min = min(valid_bwd_iat_min) if valid_bwd_iat_min else 0
-                bwd_iat_max = max(cpu_data.bwd_iat_max for cpu_data in per_cpu_data)
-                syn_count = sum(cpu_data.syn_count for cpu_data in per_cpu_data)
-                ack_count = sum(cpu_data.ack_count for cpu_data in per_cpu_data)
-                psh_count = sum(cpu_data.psh_count for cpu_data in per_cpu_data)
-                urg_count = sum(cpu_data.urg_count for cpu_data in per_cpu_data)
-                fin_count = sum(cpu_data.fin_count for cpu_data in per_cpu_data)
-                rst_count = sum(cpu_data.rst_count for cpu_data in per_cpu_data)
-
                 # Export the flow and remove from the flows map
-                flow_data = FlowData(
-                    first_seen=first_seen,
-                    last_seen=last_seen,
-                    packet_count=total_packets,
-                    byte_count=total_byte_count,
-                    fwd_packet_count=fwd_packet_count,
-                    bwd_packet_count=bwd_packet_count,
-                    fwd_byte_count=fwd_byte_count,
-                    bwd_byte_count=bwd_byte_count,
-                    min_packet_length=min_packet_length,
-                    max_packet_length=max_packet_length,
-                    packet_length_square_sum=packet_length_square_sum,
-                    flow_duration=flow_duration,
-                    flow_iat_total=flow_iat_total,
-                    flow_iat_min=flow_iat_min,
-                    flow_iat_max=flow_iat_max,
-                    fwd_iat_total=fwd_iat_total,
-                    fwd_iat_min=fwd_iat_min,
-                    fwd_iat_max=fwd_iat_max,
-                    bwd_iat_total=bwd_iat_total,
-                    bwd_iat_min=bwd_iat_min,
-                    bwd_iat_max=bwd_iat_max,
-                    syn_count=syn_count,
-                    ack_count=ack_count,
-                    psh_count=psh_count,
-                    urg_count=urg_count,
-                    fin_count=fin_count,
-                    rst_count=rst_count,
-                    idle_duration=idle_duration,
-                    active_duration=active_duration
-                )
-                exported_flows_map[key] = flow_data
-
-                prediction = predict_flow_behavior(exported_flows_map[key])
-                src_ip = inet_ntoa(ctypes.c_uint32(key.src_ip).value.to_bytes(4, 'big'))
-                dst_ip = inet_ntoa(ctypes.c_uint32(key.dst_ip).value.to_bytes(4, 'big'))
-                print(f"Flow from {src_ip} to {dst_ip} is: {prediction}")
-                if prediction == "ANOMALY DETECTED":
-                    print(f"ALERT: Anomalous flow detected from {src_ip} to {dst_ip}!")
-
-                    flow_key = FlowKey(key.src_ip, key.dst_ip, key.src_port, key.dst_port, key.protocol)
-
-                    # Serialize the FlowKey and FlowData for compression
-                    serialized_key = tuple(compression._serialize_flow_key(flow_key))
-                    serialized_flow_data = tuple(compression._serialize_flow_data(flow_data))
-
-                    # Update frequency tables for FlowKey and FlowData
-                    compression.update_frequencies(serialized_key, key_frequencies)
-                    compression.update_frequencies(serialized_flow_data, data_frequencies)
-
-                    # Append to the list of serialized data
-                    accumulated_serialized_keys.append(serialized_key)
-                    accumulated_serialized_data.append(serialized_flow_data)
-
-                    # Update global frequency tables
-                    for k, v in key_frequencies.items():
-                        accumulated_key_frequencies[k] = accumulated_key_frequencies.get(k, 0) + v
-                    for k, v in data_frequencies.items():
-                        accumulated_data_frequencies[k] = accumulated_data_frequencies.get(k, 0) + v
-
-                    else:
-                        print(f"Flow from {src_ip} to {dst_ip} is: {prediction}")
-
-                else:
-                    print(f"Flow from {src_ip} to {dst_ip} is: {prediction}")
-                    del exported_flows_map[key]  # Remove normal flow from map
-                del flows_map[key]  # Remove flow from map
-        
-        if not accumulated_serialized_keys and not accumulated_serialized_data:
-            print("No data to compress.")
-            return
-        
-        key_probs = compression.calculate_probabilities(accumulated_key_frequencies)
-        data_probs = compression.calculate_probabilities(accumulated_data_frequencies)
-
-        # Codificar las claves y los datos usando la función encode
-        encoded_keys = compression.encode(accumulated_serialized_keys, key_probs)
-        encoded_data = compression.encode(accumulated_serialized_data, data_probs)
-
-        # Guardar los datos comprimidos en un archivo binario
-        filename = "compressed_flows.dat"
-        compression.save_to_file(filename, encoded_keys, encoded_data, accumulated_serialized_keys, accumulated_serialized_data, key_probs, data_probs)
-        print("File succesfully compressed")
-
-        # Clear accumulated data
-        accumulated_serialized_keys.clear()
-        accumulated_serialized_data.clear()
-        accumulated_key_frequencies.clear()
-        accumulated_data_frequencies.clear()
+                flow_data = aggregate_flow(arr)
+                pending_flows.append((key, src_ip, dst_ip, flow_data))
+                if n_pending == len(feature_batch):
+                    feature_batch = np.resize(feature_batch, (2 * len(feature_batch), FEATURE_COUNT))
+                preprocess_flow_for_ai(flow_data, feature_batch[n_pending])
+                n_pending += 1
+                expired_keys.append(key)  # Removed from the flows map below
+            else:
+                # Still active: check again when its idle timeout can
+                # next fire (later still if traffic keeps it alive)
+                _schedule_check(key, last_seen + threshold_seconds * 1e6)
+
+        # Remove every exported flow from the map, batched when available
+        if expired_keys:
+            if hasattr(flows_map, "items_delete_batch"):
+                # The batched syscall wants one contiguous ctypes array of
+                # BCC's own Key class; keys off the check heap are our
+                # FlowKey (same layout, different class), so rebuild each
+                # element from its raw bytes instead of passing it through
+                flows_map.items_delete_batch(
+                    (flows_map.Key * len(expired_keys))(
+                        *(flows_map.Key.from_buffer_copy(bytes(k))
+                          for k in expired_keys)))
+            else:
+                for key in expired_keys:
+                    del flows_map[key]
+
+        # Hand the batch to the inference pool; the sweep thread goes back
+        # to draining the maps without waiting for the model. The rows are
+        # copied out because the shared batch is reused on the next sweep.
+        if n_pending:
+            future = executor.submit(process_predictions, pending_flows,
+                                     feature_batch[:n_pending].copy(), exported_flows_map)
+            future.add_done_callback(_log_worker_failure)
 
     def periodic_print_flows(interval):
         """
-        Periodically call export_expired_flows() to check and handle flows.
+        Sweep the flow maps every `interval` seconds on a single
+        long-lived daemon thread until stop_event is set. Returns the
+        thread so the caller can join it.
         """
-        def print_and_reschedule():
-            getting_unupdated_flows()
-            threading.Timer(interval, print_and_reschedule).start()
+        def loop():
+            while not stop_event.wait(interval):
+                getting_unupdated_flows()
 
-        print_and_reschedule()
+        thread = threading.Thread(target=loop, daemon=True)
+        thread.start()
+        return thread
 
     # Prompt the user for a sampling rate and update the eBPF map
     input_value = b.get_table("input_value")
@@ -373,8 +641,11 @@ try:
     except ValueError:
         print("Error: Please enter a valid integer value.")
         
-    periodic_print_flows(1)
+    worker = periodic_print_flows(1)
+    # Park the main thread on the worker so Ctrl-C lands in the handler
+    worker.join()
 
 except KeyboardInterrupt:
+    stop_event.set()
     b.remove_xdp(dev="enp0s8", flags=0)
     sys.exit()
\ No newline at end of file
@@ -1,5 +1,10 @@
 import struct
 
+# Precompiled field layouts for FlowKey and the serialized subset of
+# FlowData; Struct.pack assembles the bytes in C in a single call.
+_FLOW_KEY_STRUCT = struct.Struct("<IIHHB")
+_FLOW_DATA_STRUCT = struct.Struct("<QQIQIIQQHHIIII")
+
 class AdaptiveArithmeticCodingFlows:
     """
     Implements adaptive arithmetic coding for flow data compression.
@@ -11,6 +16,8 @@ class AdaptiveArithmeticCodingFlows:
         self.mask = self.max_range
         self.key_frequencies = {}
         self.data_frequencies = {}
+        self.key_total = 0
+        self.data_total = 0
 
     def calculate_probabilities(self, frequencies):
         """
@@ -21,6 +28,20 @@ class AdaptiveArithmeticCodingFlows:
             return {}
         return {k: v / total_count for k, v in frequencies.items()}
 
+    def incremental_probabilities(self, delta_counter, frequencies, total_count):
+        """
+        Fold a per-batch frequency delta into a running frequency table and
+        return the refreshed probabilities together with the new total.
+        Only the unique symbols are touched, instead of rescanning the
+        whole accumulated history on every call.
+        """
+        for symbol, count in delta_counter.items():
+            frequencies[symbol] = frequencies.get(symbol, 0) + count
+        total_count += sum(delta_counter.values())
+        if total_count == 0:
+            return {}, 0
+        return {k: v / total_count for k, v in frequencies.items()}, total_count
+
     def update_frequencies(self, data, frequency_table):
         """
         Update frequency counts for each value in 'data'.
@@ -237,21 +258,23 @@ class AdaptiveArithmeticCodingFlows:
 
     def _serialize_flow_key(self, flow_key):
         """
-        Serialize a FlowKey structure into a list of integers for compression.
+        Serialize a FlowKey structure into bytes for compression.
+        Iterating the result yields one integer symbol per byte.
         """
-        return [
+        return _FLOW_KEY_STRUCT.pack(
             flow_key.src_ip,
             flow_key.dst_ip,
             flow_key.src_port,
             flow_key.dst_port,
             flow_key.protocol
-        ]
+        )
 
     def _serialize_flow_data(self, flow_data):
         """
-        Serialize a FlowData structure into a list of integers for compression.
+        Serialize a FlowData structure into bytes for compression.
+        Iterating the result yields one integer symbol per byte.
         """
-        return [
+        return _FLOW_DATA_STRUCT.pack(
             flow_data.first_seen,
             flow_data.last_seen,
             flow_data.packet_count,
@@ -266,4 +289,4 @@ class AdaptiveArithmeticCodingFlows:
             flow_data.ack_count,
             flow_data.psh_count,
             flow_data.urg_count,
-        ]
+        )